@@ -33,19 +33,26 @@ async def get_token_info(
     db: AsyncSession = Depends(get_db),
 ):
     """Get token information."""
+    # Column-only SELECT: skip ORM entity hydration on this read path
     result = await db.execute(
-        select(GenerationToken).where(GenerationToken.token == token)
+        select(
+            GenerationToken.token,
+            GenerationToken.remaining_generations,
+            GenerationToken.total_generations,
+            GenerationToken.expires_at,
+            GenerationToken.product_sku,
+        ).where(GenerationToken.token == token)
     )
-    token_obj = result.scalar_one_or_none()
-    if not token_obj:
+    row = result.one_or_none()
+    if row is None:
         raise HTTPException(status_code=404, detail="Token not found")
 
     return TokenInfo(
-        token=token_obj.token,
-        remaining_generations=token_obj.remaining_generations,
-        total_generations=token_obj.total_generations,
-        expires_at=token_obj.expires_at.isoformat(),
-        product_sku=token_obj.product_sku,
+        token=row.token,
+        remaining_generations=row.remaining_generations,
+        total_generations=row.total_generations,
+        expires_at=row.expires_at.isoformat(),
+        product_sku=row.product_sku,
     )
 
 
@@ -56,12 +63,17 @@ async def validate_token(
 ):
     """Validate if a token is valid and has remaining generations."""
     result = await db.execute(
-        select(GenerationToken).where(GenerationToken.token == token)
+        select(
+            GenerationToken.remaining_generations,
+            GenerationToken.expires_at,
+        ).where(GenerationToken.token == token)
     )
-    token_obj = result.scalar_one_or_none()
-    if not token_obj:
+    row = result.one_or_none()
+    if row is None:
         return ValidateResponse(valid=False)
-    return ValidateResponse(valid=token_obj.is_valid)
+    return ValidateResponse(
+        valid=row.remaining_generations > 0 and datetime.utcnow() < row.expires_at
+    )
 
 
 @router.get("/tokens/by-device/{device_id}", response_model=TokenListResponse)
@@ -72,23 +84,28 @@ async def get_tokens_by_device(
     """Get all valid tokens for a device."""
     now = datetime.utcnow()
     result = await db.execute(
-        select(GenerationToken).where(
+        select(
+            GenerationToken.token,
+            GenerationToken.remaining_generations,
+            GenerationToken.total_generations,
+            GenerationToken.expires_at,
+            GenerationToken.product_sku,
+        ).where(
             GenerationToken.device_id == device_id,
             GenerationToken.remaining_generations > 0,
             GenerationToken.expires_at > now,
         )
     )
-    tokens = result.scalars().all()
 
     return TokenListResponse(
         tokens=[
             TokenInfo(
-                token=t.token,
-                remaining_generations=t.remaining_generations,
-                total_generations=t.total_generations,
-                expires_at=t.expires_at.isoformat(),
-                product_sku=t.product_sku,
+                token=row.token,
+                remaining_generations=row.remaining_generations,
+                total_generations=row.total_generations,
+                expires_at=row.expires_at.isoformat(),
+                product_sku=row.product_sku,
             )
-            for t in tokens
+            for row in result
         ]
     )
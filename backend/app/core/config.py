@@ -1,7 +1,6 @@
 """Application configuration."""
-import json
+from functools import lru_cache
 from pydantic_settings import BaseSettings
-from pydantic import field_validator
 
 
 class Settings(BaseSettings):
@@ -27,17 +26,17 @@ class Settings(BaseSettings):
     # Free trial
     FREE_TRIAL_LIMIT: int = 1
 
-    @field_validator("CREEM_PRODUCT_IDS", mode="before")
-    @classmethod
-    def parse_creem_product_ids(cls, v):
-        if isinstance(v, str) and v:
-            try:
-                return json.loads(v)
-            except json.JSONDecodeError:
-                return {}
-        return v or {}
+    # CREEM_PRODUCT_IDS needs no custom validator: pydantic-settings already
+    # JSON-decodes dict-typed env vars at the source level, so the old
+    # before-validator only ever re-parsed an already-parsed value.
 
     model_config = {"env_file": ".env", "extra": "allow"}
 
 
-settings = Settings()
+@lru_cache
+def get_settings() -> Settings:
+    """Build Settings once per process; env/.env parsing never re-runs."""
+    return Settings()
+
+
+settings = get_settings()
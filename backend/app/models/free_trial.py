@@ -1,17 +1,49 @@
 """FreeTrialTracking Model — Track free trial usage per device."""
+import os
+import time
 import uuid
-from datetime import datetime
-from sqlalchemy import Column, String, Integer, DateTime
+from sqlalchemy import Column, String, Integer, DateTime, Index, func
 from sqlalchemy.dialects.postgresql import UUID
 
 from app.core.database import Base
 
 
+def uuid7() -> uuid.UUID:
+    """Time-ordered UUIDv7 (RFC 9562): 48-bit ms timestamp + random bits.
+
+    New ids sort by creation time, so primary-key inserts land on the
+    rightmost B-tree pages instead of the random page writes uuid4 causes.
+    """
+    ts_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (
+        (ts_ms & 0xFFFFFFFFFFFF) << 80
+        | 0x7 << 76
+        | ((rand >> 62) & 0xFFF) << 64
+        | 0b10 << 62
+        | (rand & 0x3FFFFFFFFFFFFFFF)
+    )
+    return uuid.UUID(int=value)
+
+
 class FreeTrialTracking(Base):
     __tablename__ = "free_trial_tracking"
+    # Single unique covering index on device_id: it is both the ON CONFLICT
+    # arbiter for the upsert and, with uses_count riding along in the leaf
+    # pages, lets the /api/trial-status read run as an index-only scan.
+    __table_args__ = (
+        Index(
+            "ix_free_trial_device_cover",
+            "device_id",
+            unique=True,
+            postgresql_include=["uses_count"],
+        ),
+    )
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    device_id = Column(String(255), unique=True, nullable=False, index=True)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7)
+    device_id = Column(String(255), nullable=False)
     uses_count = Column(Integer, nullable=False, default=0)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Timestamps are set by the database, so the upsert path doesn't need
+    # Python-side datetime.utcnow() calls (and stays correct across app hosts).
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,107 @@
+"""LLM 输出解析的热路径。
+
+独立成纯 Python 模块（不依赖 FastAPI），以便在部署镜像里用 mypyc AOT
+编译成扩展模块；解释器环境下直接 import 源码，行为一致。
+"""
+import re
+from typing import Optional
+
+import orjson
+
+# re.ASCII：这里 \s 只需匹配 JSON 的 ASCII 空白，跳过 Unicode 属性查表
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.ASCII)
+
+_JSON_WS = " \t\r\n"
+
+
+def _skip_colon_ws(text: str, start: int) -> int:
+    """从 key 结束处跳过冒号和空白，返回值起始下标；格式不符返回 -1。"""
+    i = text.find(":", start)
+    if i < 0:
+        return -1
+    i += 1
+    n = len(text)
+    while i < n and text[i] in _JSON_WS:
+        i += 1
+    return i if i < n else -1
+
+
+def _extract_fallback(text: str) -> Optional[dict]:
+    """手写字符扫描器：从畸形输出里定位 downgraded 字符串值和 hype_score 数字。
+
+    一趟 str.find 定位 key，再逐字符带转义状态地扫出字符串值，
+    代替原来可回溯的正则回退路径。
+    """
+    key = text.find('"downgraded"')
+    if key < 0:
+        return None
+    i = _skip_colon_ws(text, key + 12)
+    if i < 0 or text[i] != '"':
+        return None
+    i += 1
+    n = len(text)
+    chars = []
+    escaped = False
+    closed = False
+    while i < n:
+        c = text[i]
+        if escaped:
+            # 只还原 \" ，其余转义对原样保留
+            chars.append(c if c == '"' else "\\" + c)
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif c == '"':
+            closed = True
+            break
+        else:
+            chars.append(c)
+        i += 1
+    if not closed:
+        return None
+
+    key = text.find('"hype_score"')
+    if key < 0:
+        return None
+    i = _skip_colon_ws(text, key + 12)
+    if i < 0 or not ("0" <= text[i] <= "9"):
+        return None
+    j = i + 1
+    while j < n and "0" <= text[j] <= "9":
+        j += 1
+
+    return {"downgraded": "".join(chars), "hype_score": int(text[i:j])}
+
+
+def _strip_fences(text: str) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        text = _FENCE_RE.sub("", text).strip()
+    return text
+
+
+def parse_llm_response(text: str) -> dict:
+    text = _strip_fences(text)
+
+    try:
+        data = orjson.loads(text)
+        if "downgraded" in data and "hype_score" in data:
+            return data
+    except orjson.JSONDecodeError:
+        pass
+
+    fallback = _extract_fallback(text)
+    if fallback is not None:
+        return fallback
+
+    raise ValueError(f"无法解析 LLM 返回: {text[:200]}")
+
+
+def parse_llm_batch_response(text: str, expected: int) -> list:
+    data = orjson.loads(_strip_fences(text))
+    if not isinstance(data, list) or len(data) != expected:
+        raise ValueError(f"批量返回长度不符: 期望 {expected}, 实际 {len(data) if isinstance(data, list) else type(data)}")
+    for item in data:
+        if not isinstance(item, dict) or "downgraded" not in item or "hype_score" not in item:
+            raise ValueError(f"批量返回项缺少字段: {item}")
+    return data
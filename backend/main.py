@@ -1,15 +1,18 @@
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, StringConstraints
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from prometheus_fastapi_instrumentator import Instrumentator
+import asyncio
 import httpx
-import json
-import re
+import orjson
 import logging
-from typing import Literal, Optional
+from typing import Annotated, Optional
 from datetime import datetime
 
 from app.core.config import settings
@@ -17,7 +20,8 @@ from app.core.database import get_db, init_db
 from app.models import GenerationToken, FreeTrialTracking
 from app.api.payment import router as payment_router
 from app.api.tokens import router as tokens_router
-from metrics import record_generation, record_token_consumed, generation_timer
+from llm_parse import parse_llm_response, parse_llm_batch_response
+from metrics import record_generation, record_token_consumed, generation_timer, metrics_asgi_app
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,12 +29,29 @@ logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Initialize database tables on startup."""
+    """Initialize database tables and the shared LLM HTTP client on startup."""
     await init_db()
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+        headers={
+            "Authorization": f"Bearer {settings.LLM_PROXY_KEY}",
+            "Content-Type": "application/json",
+        },
+    )
+    batcher.start()
     yield
+    await batcher.stop()
+    await app.state.http.aclose()
 
 
-app = FastAPI(title="AI 标题降级器", version="2.0.0", lifespan=lifespan)
+app = FastAPI(
+    title="AI 标题降级器",
+    version="2.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -44,12 +65,15 @@ app.add_middleware(
 app.include_router(payment_router, prefix="/api")
 app.include_router(tokens_router, prefix="/api")
 
-# Prometheus metrics
-Instrumentator().instrument(app).expose(app, endpoint="/api/metrics")
+# Prometheus metrics：采集仍走 Instrumentator，/api/metrics 由独立 ASGI 挂载
+# 提供预编码快照，绕开 FastAPI 路由和响应序列化
+Instrumentator().instrument(app)
+app.mount("/api/metrics", metrics_asgi_app)
 
 
-IntensityType = Literal["mild", "normal", "brutal"]
-LangType = Literal["en", "zh", "ja", "de", "fr", "ko", "es"]
+# 用 pydantic-core 里编译好的正则做校验，比 Literal 的逐项比较分支更快
+IntensityType = Annotated[str, StringConstraints(pattern=r"^(?:mild|normal|brutal)$")]
+LangType = Annotated[str, StringConstraints(pattern=r"^(?:en|zh|ja|de|fr|ko|es)$")]
 
 
 class DowngradeRequest(BaseModel):
@@ -87,37 +111,31 @@ INTENSITY_EN = {
 
 
 async def call_llm(prompt: str) -> str:
-    """调用 LLM 代理"""
+    """调用 LLM 代理（复用 lifespan 中创建的连接池）"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{settings.LLM_PROXY_URL}/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {settings.LLM_PROXY_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": settings.LLM_MODEL,
-                    "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 500,
-                    "temperature": 0.8,
-                },
-                timeout=30.0,
-            )
-            response.raise_for_status()
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
+        client: httpx.AsyncClient = app.state.http
+        response = await client.post(
+            f"{settings.LLM_PROXY_URL}/v1/chat/completions",
+            content=orjson.dumps({
+                "model": settings.LLM_MODEL,
+                "messages": [{"role": "user", "content": prompt}],
+                "max_tokens": 500,
+                "temperature": 0.8,
+            }),
+        )
+        response.raise_for_status()
+        result = orjson.loads(response.content)
+        return result["choices"][0]["message"]["content"]
     except Exception as e:
         logger.error(f"LLM API 调用失败: {e}")
         raise HTTPException(status_code=500, detail=f"AI 生成失败: {str(e)}")
 
 
-def build_prompt(title: str, intensity: IntensityType, language: LangType) -> str:
-    if language == "en":
-        desc = INTENSITY_EN[intensity]
-        return f"""You are a title downgrader. Take exaggerated, clickbait, or marketing titles and rewrite them to be plain, honest, and mundane.
+# 提示词模板在导入时按 (语言, 强度) 预生成；热路径上只剩一次 dict 查找
+# 和一次 str.format 填标题。JSON 示例里的花括号为 format 转义写成双份。
+_EN_TEMPLATE = """You are a title downgrader. Take exaggerated, clickbait, or marketing titles and rewrite them to be plain, honest, and mundane.
 
-Intensity: {desc}
+Intensity: <desc>
 
 Exaggerated title: "{title}"
 
@@ -126,11 +144,10 @@ Respond in this EXACT JSON format (no markdown, no code blocks):
 
 hype_score = how exaggerated the original is (1=normal, 10=absurdly hyped).
 Make the downgraded version funny by being aggressively ordinary."""
-    else:
-        desc = INTENSITY_ZH[intensity]
-        return f"""你是一个标题降级器。把夸张的标题/营销文案/点击诱饵还原成平实、诚实、甚至有点无聊的描述。
 
-降级强度：{desc}
+_ZH_TEMPLATE = """你是一个标题降级器。把夸张的标题/营销文案/点击诱饵还原成平实、诚实、甚至有点无聊的描述。
+
+降级强度：<desc>
 
 夸张标题："{title}"
 
@@ -140,30 +157,252 @@ Make the downgraded version funny by being aggressively ordinary."""
 hype_score = 原标题的夸张程度（1=正常, 10=极度夸张）。
 降级版本要通过极度平淡来制造反差幽默。"""
 
+_EN_BATCH_TEMPLATE = """You are a title downgrader. Take exaggerated, clickbait, or marketing titles and rewrite them to be plain, honest, and mundane.
 
-def parse_llm_response(text: str) -> dict:
-    text = text.strip()
-    text = re.sub(r"^```(?:json)?\s*", "", text)
-    text = re.sub(r"\s*```$", "", text)
-    text = text.strip()
+Intensity: <desc>
 
-    try:
-        data = json.loads(text)
-        if "downgraded" in data and "hype_score" in data:
-            return data
-    except json.JSONDecodeError:
-        pass
+Exaggerated titles (JSON array, item i corresponds to output item i):
+{titles}
 
-    down_match = re.search(r'"downgraded"\s*:\s*"([^"]*(?:\\.[^"]*)*)"', text)
-    score_match = re.search(r'"hype_score"\s*:\s*(\d+)', text)
+Respond with a JSON array of the same length, in the same order (no markdown, no code blocks):
+[{{"downgraded": "the plain version", "hype_score": 7}}, ...]
+
+hype_score = how exaggerated the original is (1=normal, 10=absurdly hyped).
+Make each downgraded version funny by being aggressively ordinary."""
 
-    if down_match and score_match:
-        return {
-            "downgraded": down_match.group(1).replace('\\"', '"'),
-            "hype_score": int(score_match.group(1)),
-        }
+_ZH_BATCH_TEMPLATE = """你是一个标题降级器。把夸张的标题/营销文案/点击诱饵还原成平实、诚实、甚至有点无聊的描述。
 
-    raise ValueError(f"无法解析 LLM 返回: {text[:200]}")
+降级强度：<desc>
+
+夸张标题（JSON 数组，第 i 项对应输出第 i 项）：
+{titles}
+
+请严格返回等长、同序的 JSON 数组（不要 markdown，不要代码块）：
+[{{"downgraded": "平实版本", "hype_score": 7}}, ...]
+
+hype_score = 原标题的夸张程度（1=正常, 10=极度夸张）。
+降级版本要通过极度平淡来制造反差幽默。"""
+
+PROMPT_TEMPLATES = {
+    **{("en", i): _EN_TEMPLATE.replace("<desc>", d) for i, d in INTENSITY_EN.items()},
+    **{("zh", i): _ZH_TEMPLATE.replace("<desc>", d) for i, d in INTENSITY_ZH.items()},
+}
+
+BATCH_PROMPT_TEMPLATES = {
+    **{("en", i): _EN_BATCH_TEMPLATE.replace("<desc>", d) for i, d in INTENSITY_EN.items()},
+    **{("zh", i): _ZH_BATCH_TEMPLATE.replace("<desc>", d) for i, d in INTENSITY_ZH.items()},
+}
+
+
+def build_prompt(title: str, intensity: IntensityType, language: LangType) -> str:
+    key = "en" if language == "en" else "zh"
+    return PROMPT_TEMPLATES[(key, intensity)].format(title=title)
+
+
+async def call_llm_stream(body: bytes) -> str:
+    """流式调用 LLM 代理：SSE 分片到达即解码，下载与模型生成重叠。
+
+    body 为 build_llm_body 预拼好的请求字节。
+    """
+    try:
+        client: httpx.AsyncClient = app.state.http
+        chunks = []
+        async with client.stream(
+            "POST",
+            f"{settings.LLM_PROXY_URL}/v1/chat/completions",
+            content=body,
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                delta = orjson.loads(data)["choices"][0].get("delta", {})
+                content = delta.get("content")
+                if content:
+                    chunks.append(content)
+        return "".join(chunks)
+    except Exception as e:
+        logger.error(f"LLM API 调用失败: {e}")
+        raise HTTPException(status_code=500, detail=f"AI 生成失败: {str(e)}")
+
+
+def build_batch_prompt(titles: list, intensity: IntensityType, language: LangType) -> str:
+    key = "en" if language == "en" else "zh"
+    return BATCH_PROMPT_TEMPLATES[(key, intensity)].format(titles=orjson.dumps(titles).decode())
+
+
+def _build_body_templates() -> dict:
+    """按 (语言, 强度) 预序列化整个请求体，在标题处留一个字节级切口。
+
+    运行时只需把 orjson 转义后的标题拼进切口，免去每次请求整体 dumps。
+    """
+    sentinel = "@@TITLE@@"
+    templates = {}
+    for key, template in PROMPT_TEMPLATES.items():
+        body = orjson.dumps({
+            "model": settings.LLM_MODEL,
+            "messages": [{"role": "user", "content": template.format(title=sentinel)}],
+            "max_tokens": 500,
+            "temperature": 0.8,
+            "stream": True,
+        })
+        prefix, _, suffix = body.partition(sentinel.encode())
+        templates[key] = (prefix, suffix)
+    return templates
+
+
+BODY_TEMPLATES = _build_body_templates()
+
+
+def build_llm_body(title: str, intensity: IntensityType, language: LangType) -> bytes:
+    key = "en" if language == "en" else "zh"
+    prefix, suffix = BODY_TEMPLATES[(key, intensity)]
+    # orjson.dumps(title) 给出带转义的 JSON 字符串，去掉首尾引号后正好嵌进字符串切口
+    return prefix + orjson.dumps(title)[1:-1] + suffix
+
+
+class LLMBatcher:
+    """将短时间窗口内到达的并发降级请求合并为一次 LLM 调用。
+
+    按 (intensity, language) 分组共享 system prompt；每个请求通过 Future
+    拿回自己的结果。批量调用失败时逐条回退到单次调用，超长标题直接走单次路径。
+    """
+
+    def __init__(self, window_ms: int = 30, max_batch: int = 8,
+                 max_title_len: int = 500, max_concurrency: int = 16):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.max_title_len = max_title_len
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._worker())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, title: str, intensity: IntensityType, language: LangType) -> dict:
+        if len(title) > self.max_title_len:
+            # 超长标题不进批，避免撑爆共享 prompt 的上下文
+            return await self._call_single(title, intensity, language)
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((title, intensity, language, future))
+        return await future
+
+    async def _call_single(self, title: str, intensity: IntensityType, language: LangType) -> dict:
+        async with self._semaphore:
+            raw = await call_llm_stream(build_llm_body(title, intensity, language))
+        return parse_llm_response(raw)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            groups: dict = {}
+            for title, intensity, language, future in batch:
+                groups.setdefault((intensity, language), []).append((title, future))
+            for (intensity, language), items in groups.items():
+                loop.create_task(self._run_group(intensity, language, items))
+
+    async def _run_group(self, intensity: IntensityType, language: LangType, items: list):
+        if len(items) == 1:
+            title, future = items[0]
+            try:
+                result = await self._call_single(title, intensity, language)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            return
+
+        titles = [title for title, _ in items]
+        try:
+            async with self._semaphore:
+                raw = await call_llm(build_batch_prompt(titles, intensity, language))
+            results = parse_llm_batch_response(raw, len(titles))
+        except Exception as e:
+            logger.warning(f"批量调用失败，逐条回退: {e}")
+            await asyncio.gather(*[
+                self._run_group(intensity, language, [item]) for item in items
+            ])
+            return
+        for (title, future), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
+
+
+batcher = LLMBatcher()
+
+
+class AsyncTTLCache:
+    """进程内 LRU + TTL 缓存，用 in-flight Future 合并并发的相同请求。
+
+    命中时把一次秒级、花钱的 LLM 调用变成一次字典查找；同一个 key 的并发
+    未命中只触发一次计算，其余请求等同一个 Future。
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (expiry, future)
+
+    async def get_or_compute(self, key, compute):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        entry = self._data.get(key)
+        if entry is not None:
+            expiry, future = entry
+            if expiry > now and not future.cancelled():
+                self._data.move_to_end(key)
+                return await asyncio.shield(future)
+            del self._data[key]
+
+        future = loop.create_future()
+        self._data[key] = (now + self.ttl, future)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        try:
+            result = await compute()
+        except BaseException as e:
+            # 包括 CancelledError（客户端断开时 Starlette 会取消 handler）：
+            # 必须摘掉缓存项并了结 Future，否则后续同 key 请求会永远挂在 shield 上
+            self._data.pop(key, None)
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                future.exception()  # 标记已取出，避免 GC 时的未取异常警告
+            else:
+                future.cancel()
+            raise
+        future.set_result(result)
+        return result
+
+
+llm_cache = AsyncTTLCache()
 
 
 async def check_and_use_free_trial(device_id: str, db: AsyncSession) -> bool:
@@ -171,23 +410,25 @@ async def check_and_use_free_trial(device_id: str, db: AsyncSession) -> bool:
     if not device_id:
         return False
 
-    result = await db.execute(
-        select(FreeTrialTracking).where(FreeTrialTracking.device_id == device_id)
+    # 单条 upsert：首次使用插入，否则在未超限时原子地 +1。
+    # 以 device_id 上已有的唯一索引作为冲突目标，避免 SELECT+UPDATE 两趟往返和并发竞态。
+    stmt = (
+        pg_insert(FreeTrialTracking)
+        .values(device_id=device_id, uses_count=1)
+        .on_conflict_do_update(
+            index_elements=[FreeTrialTracking.device_id],
+            # onupdate 不会作用到 ON CONFLICT 的 DO UPDATE，updated_at 要显式带上
+            set_={
+                "uses_count": FreeTrialTracking.uses_count + 1,
+                "updated_at": func.now(),
+            },
+            where=FreeTrialTracking.uses_count < settings.FREE_TRIAL_LIMIT,
+        )
+        .returning(FreeTrialTracking.uses_count)
     )
-    tracking = result.scalar_one_or_none()
-
-    if tracking is None:
-        # First use — create tracking and allow
-        tracking = FreeTrialTracking(device_id=device_id, uses_count=1)
-        db.add(tracking)
-        await db.commit()
-        return True
-    elif tracking.uses_count < settings.FREE_TRIAL_LIMIT:
-        tracking.uses_count += 1
-        await db.commit()
-        return True
-    else:
-        return False
+    result = await db.execute(stmt)
+    await db.commit()
+    return result.scalar_one_or_none() is not None
 
 
 async def check_and_use_token(token_str: str, db: AsyncSession) -> bool:
@@ -195,15 +436,21 @@ async def check_and_use_token(token_str: str, db: AsyncSession) -> bool:
     if not token_str:
         return False
 
-    result = await db.execute(
-        select(GenerationToken).where(GenerationToken.token == token_str)
+    # 校验 + 扣减合并成一条原子 UPDATE，省掉 SELECT 往返，
+    # 也避免并发请求对同一 token 的 check-then-act 竞态
+    stmt = (
+        update(GenerationToken)
+        .where(
+            GenerationToken.token == token_str,
+            GenerationToken.remaining_generations > 0,
+            GenerationToken.expires_at > datetime.utcnow(),
+        )
+        .values(remaining_generations=GenerationToken.remaining_generations - 1)
+        .returning(GenerationToken.remaining_generations)
     )
-    token_obj = result.scalar_one_or_none()
-
-    if token_obj and token_obj.use_generation():
-        await db.commit()
-        return True
-    return False
+    result = await db.execute(stmt)
+    await db.commit()
+    return result.scalar_one_or_none() is not None
 
 
 @app.get("/health")
@@ -214,15 +461,16 @@ async def health_check():
 @app.get("/api/trial-status/{device_id}", response_model=TrialStatusResponse)
 async def get_trial_status(device_id: str, db: AsyncSession = Depends(get_db)):
     """Check free trial status for a device."""
+    # 只取需要的标量列，跳过 ORM 实体水合和身份映射登记
     result = await db.execute(
-        select(FreeTrialTracking).where(FreeTrialTracking.device_id == device_id)
+        select(FreeTrialTracking.uses_count).where(FreeTrialTracking.device_id == device_id)
     )
-    tracking = result.scalar_one_or_none()
+    uses_count = result.scalar_one_or_none()
 
-    if tracking is None:
+    if uses_count is None:
         return TrialStatusResponse(has_free_trial=True, uses_remaining=settings.FREE_TRIAL_LIMIT)
     else:
-        remaining = max(0, settings.FREE_TRIAL_LIMIT - tracking.uses_count)
+        remaining = max(0, settings.FREE_TRIAL_LIMIT - uses_count)
         return TrialStatusResponse(has_free_trial=remaining > 0, uses_remaining=remaining)
 
 
@@ -254,9 +502,11 @@ async def downgrade_title(request: DowngradeRequest, db: AsyncSession = Depends(
         )
 
     try:
-        prompt = build_prompt(request.title, request.intensity, request.language)
-        raw = await call_llm(prompt)
-        parsed = parse_llm_response(raw)
+        cache_key = (request.title.strip().lower(), request.intensity, request.language)
+        parsed = await llm_cache.get_or_compute(
+            cache_key,
+            lambda: batcher.submit(request.title, request.intensity, request.language),
+        )
 
         hype = max(1, min(10, parsed["hype_score"]))
 
@@ -277,4 +527,4 @@ async def downgrade_title(request: DowngradeRequest, db: AsyncSession = Depends(
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
@@ -1,8 +1,10 @@
 """
 Prometheus Metrics for DenseMatrix Demo Tools
 """
-from prometheus_client import Counter, Histogram
+from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
 import os
+import threading
+import time
 
 TOOL_SLUG = os.getenv("TOOL_SLUG", "title-downgrader")
 
@@ -58,3 +60,36 @@ def record_token_consumed(count: int = 1):
 
 def generation_timer():
     return GENERATION_LATENCY.labels(tool=TOOL_SLUG).time()
+
+
+# Scrape endpoint: /api/metrics is served by a bare ASGI app mounted outside
+# the FastAPI router, with the encoded exposition text cached briefly so
+# scrapes (and anything else hitting the endpoint) don't re-walk the registry.
+_SNAPSHOT_TTL = 1.0
+_snapshot: bytes = b""
+_snapshot_at: float = 0.0
+_snapshot_lock = threading.Lock()
+
+
+def metrics_snapshot() -> bytes:
+    global _snapshot, _snapshot_at
+    now = time.monotonic()
+    if now - _snapshot_at >= _SNAPSHOT_TTL:
+        with _snapshot_lock:
+            if now - _snapshot_at >= _SNAPSHOT_TTL:
+                _snapshot = generate_latest()
+                _snapshot_at = now
+    return _snapshot
+
+
+async def metrics_asgi_app(scope, receive, send):
+    payload = metrics_snapshot()
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", CONTENT_TYPE_LATEST.encode("latin-1")),
+            (b"content-length", str(len(payload)).encode("latin-1")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": payload})
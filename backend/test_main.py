@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, AsyncMock, MagicMock
@@ -142,6 +143,115 @@ def test_prompt_all_intensities():
         assert len(p) > 50
 
 
+# ===== batching tests =====
+
+def test_batch_prompt_zh():
+    from main import build_batch_prompt
+    p = build_batch_prompt(["标题一", "标题二"], "normal", "zh")
+    assert "标题一" in p
+    assert "标题二" in p
+
+
+def test_batch_prompt_en():
+    from main import build_batch_prompt
+    p = build_batch_prompt(["Title A", "Title B"], "brutal", "en")
+    assert "Title A" in p
+    assert "brutal" in p
+
+
+def test_parse_batch_valid():
+    from main import parse_llm_batch_response
+    r = parse_llm_batch_response('[{"downgraded": "a", "hype_score": 3}, {"downgraded": "b", "hype_score": 5}]', 2)
+    assert len(r) == 2
+    assert r[1]["downgraded"] == "b"
+
+
+def test_parse_batch_wrong_length():
+    from main import parse_llm_batch_response
+    with pytest.raises(ValueError):
+        parse_llm_batch_response('[{"downgraded": "a", "hype_score": 3}]', 2)
+
+
+@pytest.mark.asyncio
+async def test_batcher_merges_concurrent_calls():
+    from main import LLMBatcher
+    b = LLMBatcher(window_ms=20)
+    with patch('main.call_llm', new_callable=AsyncMock) as mock_llm:
+        mock_llm.return_value = '[{"downgraded": "a", "hype_score": 3}, {"downgraded": "b", "hype_score": 5}]'
+        r1, r2 = await asyncio.gather(
+            b.submit("Title A!", "normal", "en"),
+            b.submit("Title B!", "normal", "en"),
+        )
+    await b.stop()
+    assert mock_llm.call_count == 1
+    assert r1["downgraded"] == "a"
+    assert r2["downgraded"] == "b"
+
+
+# ===== cache tests =====
+
+@pytest.mark.asyncio
+async def test_cache_hit_skips_compute():
+    from main import AsyncTTLCache
+    cache = AsyncTTLCache(maxsize=4, ttl=60.0)
+    compute = AsyncMock(return_value={"downgraded": "ok", "hype_score": 5})
+    r1 = await cache.get_or_compute(("t", "normal", "en"), compute)
+    r2 = await cache.get_or_compute(("t", "normal", "en"), compute)
+    assert compute.call_count == 1
+    assert r1 == r2
+
+
+@pytest.mark.asyncio
+async def test_cache_collapses_concurrent_misses():
+    from main import AsyncTTLCache
+    cache = AsyncTTLCache()
+
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"downgraded": "ok", "hype_score": 5}
+
+    r1, r2 = await asyncio.gather(
+        cache.get_or_compute(("t", "normal", "en"), compute),
+        cache.get_or_compute(("t", "normal", "en"), compute),
+    )
+    assert calls == 1
+    assert r1 == r2
+
+
+@pytest.mark.asyncio
+async def test_cache_cancelled_compute_does_not_poison_key():
+    from main import AsyncTTLCache
+    cache = AsyncTTLCache()
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    task = asyncio.ensure_future(cache.get_or_compute(("t",), slow))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    compute = AsyncMock(return_value={"downgraded": "ok", "hype_score": 5})
+    r = await asyncio.wait_for(cache.get_or_compute(("t",), compute), timeout=1.0)
+    assert r["downgraded"] == "ok"
+
+
+@pytest.mark.asyncio
+async def test_cache_evicts_lru():
+    from main import AsyncTTLCache
+    cache = AsyncTTLCache(maxsize=1, ttl=60.0)
+    compute = AsyncMock(return_value={"downgraded": "ok", "hype_score": 5})
+    await cache.get_or_compute(("a",), compute)
+    await cache.get_or_compute(("b",), compute)
+    await cache.get_or_compute(("a",), compute)
+    assert compute.call_count == 3
+
+
 # ===== parse_llm_response tests =====
 
 def test_parse_valid():
@@ -160,6 +270,12 @@ def test_parse_regex_fallback():
     assert r["downgraded"] == "ok"
 
 
+def test_parse_fallback_escaped_quote():
+    r = parse_llm_response('{"downgraded": "he said \\"hi\\"", "hype_score": 5,}')
+    assert r["downgraded"] == 'he said "hi"'
+    assert r["hype_score"] == 5
+
+
 def test_parse_invalid():
     with pytest.raises(ValueError):
         parse_llm_response("garbage")
@@ -172,14 +288,11 @@ async def test_call_llm_success():
     from main import call_llm
     mock_resp = MagicMock()
     mock_resp.raise_for_status = MagicMock()
-    mock_resp.json.return_value = {"choices": [{"message": {"content": "test"}}]}
-
-    with patch('main.httpx.AsyncClient') as cls:
-        mc = AsyncMock()
-        mc.post.return_value = mock_resp
-        mc.__aenter__ = AsyncMock(return_value=mc)
-        mc.__aexit__ = AsyncMock(return_value=False)
-        cls.return_value = mc
+    mock_resp.content = b'{"choices": [{"message": {"content": "test"}}]}'
+
+    mc = AsyncMock()
+    mc.post.return_value = mock_resp
+    with patch.object(app.state, "http", mc, create=True):
         assert await call_llm("p") == "test"
 
 
@@ -187,15 +300,53 @@ async def test_call_llm_success():
 async def test_call_llm_error():
     from main import call_llm
     from fastapi import HTTPException
-    with patch('main.httpx.AsyncClient') as cls:
-        mc = AsyncMock()
-        mc.post.side_effect = Exception("fail")
-        mc.__aenter__ = AsyncMock(return_value=mc)
-        mc.__aexit__ = AsyncMock(return_value=False)
-        cls.return_value = mc
+    mc = AsyncMock()
+    mc.post.side_effect = Exception("fail")
+    with patch.object(app.state, "http", mc, create=True):
         with pytest.raises(HTTPException):
             await call_llm("p")
 
 
+@pytest.mark.asyncio
+async def test_call_llm_stream():
+    from main import call_llm_stream
+
+    class FakeStream:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            return False
+
+        def raise_for_status(self):
+            pass
+
+        async def aiter_lines(self):
+            yield 'data: {"choices": [{"delta": {"content": "he"}}]}'
+            yield ''
+            yield 'data: {"choices": [{"delta": {"content": "llo"}}]}'
+            yield 'data: [DONE]'
+
+    mc = MagicMock()
+    mc.stream = MagicMock(return_value=FakeStream())
+    with patch.object(app.state, "http", mc, create=True):
+        assert await call_llm_stream(b'{}') == "hello"
+
+
+def test_body_template_matches_prompt():
+    import orjson
+    from main import build_llm_body
+    title = 'He said "hi"\n你好'
+    body = orjson.loads(build_llm_body(title, "normal", "zh"))
+    assert body["messages"][0]["content"] == build_prompt(title, "normal", "zh")
+    assert body["stream"] is True
+
+
+def test_metrics_endpoint():
+    r = client.get("/api/metrics")
+    assert r.status_code == 200
+    assert "generation_total" in r.text
+
+
 def test_app_meta():
     assert app.title == "AI 标题降级器"